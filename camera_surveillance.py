@@ -1,18 +1,19 @@
 import cv2
+import numpy as np
 import os
 import time
 import logging
 import urllib.parse
 import google.generativeai as genai
 from datetime import datetime, timedelta
-from PIL import Image
-import io
 import json
-import base64
-import requests
+import orjson
 from dotenv import load_dotenv
 from telegram_notifier import TelegramNotifier
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from capture_utils import connect_first, gstreamer_available, log_jpeg_backend, read_latest_frame
+from gemini_utils import build_payload_template, encode_image_to_base64, post_image
 
 # Load environment variables
 load_dotenv()
@@ -27,12 +28,35 @@ logging.basicConfig(
     ]
 )
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
-GEMINI_FLASH_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent"
+SURVEILLANCE_PROMPT = """Analyze this surveillance image and identify any notable activities, people, or objects.
+Look for:
+1. Number of people present
+2. What activities people are engaged in
+3. Any unusual or suspicious behavior
+4. Key objects in the scene
+5. General description of the environment
+
+Provide a detailed analysis of what you observe in this surveillance footage."""
+
+PAYLOAD_TEMPLATE = build_payload_template(SURVEILLANCE_PROMPT)
+
+# JPEG quality for archived frames and Gemini uploads. Archived and Telegram images are smaller than
+# at OpenCV's default of 95, Gemini uploads are larger than at the Pillow default of 75 used before
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85]
+
+# Resolution frames are reduced to before comparing them for motion
+MOTION_SIZE = (160, 90)
+
+# Grayscale change (0-255) a pixel needs before it counts as changed rather than sensor noise
+MOTION_NOISE_FLOOR = 25
+
+def log_task_error(task):
+    """Log the exception of a background frame-processing task, since nothing awaits it."""
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Error processing frame: {str(task.exception())}")
 
 class CameraSurveillance:
-    def __init__(self, camera_ip, username, password, port=554, channel=1, output_dir="surveillance_images"):
+    def __init__(self, camera_ip, username, password, port=554, channel=1, use_gstreamer=False, motion_threshold=0.005, per_file_results=False, output_dir="surveillance_images"):
         """
         Initialize the camera surveillance system.
         
@@ -42,6 +66,14 @@ class CameraSurveillance:
             password (str): Camera login password.
             port (int): RTSP port (default: 554).
             channel (int): Camera channel number (default: 1).
+            use_gstreamer (bool): Open the stream through a low-latency GStreamer pipeline
+                instead of FFmpeg (default: False). Falls back to FFmpeg if OpenCV
+                was built without GStreamer.
+            motion_threshold (float): Fraction of pixels that must have changed since the last
+                analyzed frame for a frame to be sent for analysis (default: 0.005, i.e. 0.5%).
+                Set to 0 to analyze every frame.
+            per_file_results (bool): Write each analysis to its own pretty-printed JSON file
+                instead of appending it to analysis_results/events.ndjson (default: False).
             output_dir (str): Directory to save captured images.
         """
         self.camera_ip = camera_ip
@@ -51,9 +83,24 @@ class CameraSurveillance:
         self.channel = channel
         self.output_dir = output_dir
         self.analysis_dir = "analysis_results"
+        self.per_file_results = per_file_results
         self.cap = None
         self.telegram = TelegramNotifier()
 
+        log_jpeg_backend()
+
+        if use_gstreamer and not gstreamer_available():
+            logging.warning("OpenCV was built without GStreamer support, falling back to FFmpeg")
+            use_gstreamer = False
+        self.use_gstreamer = use_gstreamer
+
+        # Downscaled grayscale copy of the last analyzed frame
+        self.motion_threshold = motion_threshold
+        self.motion_reference = None
+
+        # Archival writes happen off the capture path
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
         # Create output directories if they don't exist
         os.makedirs(self.output_dir, exist_ok=True)
         os.makedirs(self.analysis_dir, exist_ok=True)
@@ -65,139 +112,115 @@ class CameraSurveillance:
             f"rtsp://{self.username}:{self.password}@{camera_ip}:{port}/Streaming/Channels/{channel}01",
             f"rtsp://{self.username}:{self.password}@{camera_ip}:{port}/live/ch{channel}/main"
         ]
+
+        # FFmpeg options for better streaming and low latency, applied when each capture is opened
+        self.ffmpeg_options = "rtsp_transport;udp|buffer_size;512000|max_delay;500000|flags;low_delay|fflags;nobuffer"
     
     def connect(self):
         """
         Try connecting to the camera using different RTSP URL formats.
         
+        All URL formats are probed in parallel and the first one to deliver a frame is used.
+        
         Returns:
             bool: True if connection successful and a test frame is retrieved, False otherwise.
         """
-        for url in self.rtsp_urls:
-            try:
-                logging.info(f"Attempting to connect using URL: {url}")
-                
-                # Set FFmpeg options for better streaming
-                os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;udp|buffer_size;512000|max_delay;500000"
-                
-                # Create VideoCapture object with FFmpeg backend
-                self.cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
-                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 3)  # Set buffer size
-                
-                if self.cap is None or not self.cap.isOpened():
-                    logging.warning(f"Failed to open video capture for URL: {url}")
-                    continue
-                    
-                # Try reading a test frame for a few seconds
-                start_time = time.time()
-                while time.time() - start_time < 5:  # 5 second timeout
-                    ret, frame = self.cap.read()
-                    if ret and frame is not None and frame.size > 0:
-                        logging.info(f"Successfully connected to camera using URL: {url}")
-                        return True
-                    time.sleep(0.1)
-                
-                logging.warning(f"Unable to retrieve a test frame from URL: {url}")
-                self.cap.release()
-                
-            except Exception as e:
-                logging.warning(f"Error connecting using URL {url}: {str(e)}")
-                if self.cap:
-                    self.cap.release()
-                continue
+        self.cap = connect_first(self.rtsp_urls, self.use_gstreamer, self.ffmpeg_options)
+        if self.cap is not None:
+            return True
         
         logging.error("Failed to connect using any available RTSP URL format")
         return False
     
     def capture_frame(self):
         """
-        Capture a single frame from the camera and save it to the output directory.
+        Capture a single frame from the camera and schedule saving it to the output directory.
         
         Returns:
-            tuple: (bool, str) - Success status and path to saved image if successful
+            tuple: (bool, ndarray, bytes, str) - Success status, the BGR frame, the frame
+                encoded as JPEG and the path the image is being saved to if successful
         """
         if self.cap is None or not self.cap.isOpened():
             logging.error("Camera connection not established")
-            return False, None
-        
-        # Try to read a frame with timeout
-        start_time = time.time()
-        while time.time() - start_time < 3:  # 3 second timeout
-            ret, frame = self.cap.read()
-            if ret and frame is not None and frame.size > 0:
-                break
-            time.sleep(0.1)
+            return False, None, None, None
         
-        if not ret or frame is None or frame.size == 0:
+        ret, frame = read_latest_frame(self.cap)
+        if not ret:
             logging.error("Failed to capture valid frame")
-            return False, None
+            return False, None, None, None
         
         # Generate a filename with a timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = os.path.join(self.output_dir, f"frame_{timestamp}.jpg")
         
-        # Save the frame to a file
-        cv2.imwrite(filename, frame)
-        logging.info(f"Captured frame saved to {filename}")
-        return True, filename
+        # Encode once, the same JPEG is archived and sent to Telegram
+        ok, buffer = cv2.imencode('.jpg', frame, JPEG_PARAMS)
+        if not ok:
+            logging.error("Failed to encode captured frame")
+            return False, None, None, None
+        jpg_bytes = buffer.tobytes()
+        
+        # Save the frame to a file in the background
+        self.writer.submit(self.save_image, filename, jpg_bytes)
+        logging.info(f"Captured frame queued for saving to {filename}")
+        return True, frame, jpg_bytes, filename
+    
+    def save_image(self, filename, jpg_bytes):
+        """
+        Write an encoded JPEG image to disk.
+        
+        Args:
+            filename (str): Destination path
+            jpg_bytes (bytes): JPEG-encoded image
+        """
+        try:
+            with open(filename, 'wb') as f:
+                f.write(jpg_bytes)
+        except OSError as e:
+            logging.error(f"Error saving image to {filename}: {str(e)}")
     
-    def encode_image_to_base64(self, image_path):
-        """Convert image to base64 string."""
-        img = Image.open(image_path)
+    def has_motion(self, frame):
+        """
+        Check whether the scene changed enough since the last analyzed frame to be worth analyzing.
+        
+        Args:
+            frame (ndarray): BGR frame to check
+            
+        Returns:
+            bool: True if the frame should be analyzed, False otherwise.
+        """
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
         
-        # Resize image if too large (max 4MB)
-        max_size = (1024, 1024)
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        if self.motion_reference is not None:
+            # Count changed pixels rather than averaging, so a small moving object isn't diluted
+            # by the rest of the frame
+            diff = cv2.absdiff(gray, self.motion_reference)
+            changed = np.count_nonzero(diff > MOTION_NOISE_FLOOR) / diff.size
+            if changed < self.motion_threshold:
+                logging.info(f"No significant change in scene ({changed:.2%} of pixels changed), skipping analysis")
+                return False
         
-        buffered = io.BytesIO()
-        img.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return img_str
+        self.motion_reference = gray
+        return True
     
-    def analyze_image(self, image_path):
+    def analyze_image(self, frame, image_path):
         """
         Analyze an image using Gemini Flash 2.0 API.
         
         Args:
-            image_path (str): Path to the image to analyze
+            frame (ndarray): BGR frame to analyze
+            image_path (str): Path the frame is saved to
             
         Returns:
             dict: Analysis results with timestamp and analysis text
         """
         try:
             # Convert image to base64
-            image_base64 = self.encode_image_to_base64(image_path)
-            
-            # Create the request payload
-            payload = {
-                "contents": [{
-                    "parts":[{
-                        "text": """Analyze this surveillance image and identify any notable activities, people, or objects.
-                        Look for:
-                        1. Number of people present
-                        2. What activities people are engaged in
-                        3. Any unusual or suspicious behavior
-                        4. Key objects in the scene
-                        5. General description of the environment
-                        
-                        Provide a detailed analysis of what you observe in this surveillance footage."""
-                    },
-                    {
-                        "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": image_base64
-                        }
-                    }]
-                }]
-            }
+            image_base64 = encode_image_to_base64(frame, JPEG_PARAMS)
             
             # Make the API request
-            headers = {
-                'Content-Type': 'application/json',
-                'x-goog-api-key': GEMINI_API_KEY
-            }
-            
-            response = requests.post(GEMINI_FLASH_URL, headers=headers, json=payload)
+            response = post_image(PAYLOAD_TEMPLATE, image_base64)
             
             if response.status_code == 200:
                 result = response.json()
@@ -221,12 +244,13 @@ class CameraSurveillance:
                 'analysis': f"Error: {str(e)}"
             }
     
-    async def send_to_telegram(self, analysis_result):
+    async def send_to_telegram(self, analysis_result, jpg_bytes):
         """
         Send the analysis and image to Telegram.
         
         Args:
             analysis_result (dict): Analysis result containing timestamp, image path, and analysis text
+            jpg_bytes (bytes): JPEG-encoded image that was analyzed
         """
         try:
             # Format message
@@ -239,10 +263,10 @@ class CameraSurveillance:
             # Send message
             await self.telegram.send_message(message)
             
-            # Send image
+            # Send image straight from memory rather than reading the saved file back
             await self.telegram.bot.send_photo(
                 chat_id=self.telegram.chat_id,
-                photo=open(analysis_result['image_path'], 'rb'),
+                photo=jpg_bytes,
                 caption=f"Surveillance image captured at {analysis_result['timestamp']}"
             )
             
@@ -259,11 +283,19 @@ class CameraSurveillance:
     
     def save_analysis_results(self, analysis_result):
         """
-        Save analysis results to a JSON file.
+        Save analysis results, appended as one line to an NDJSON file or to their own JSON file.
         
         Args:
             analysis_result (dict): Analysis result containing timestamp, image path, and analysis text
         """
+        if not self.per_file_results:
+            filename = os.path.join(self.analysis_dir, "events.ndjson")
+            with open(filename, 'ab') as f:
+                f.write(orjson.dumps(analysis_result, option=orjson.OPT_APPEND_NEWLINE))
+            
+            logging.info(f"Analysis results appended to {filename}")
+            return
+        
         # Create a filename with a timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = os.path.join(self.analysis_dir, f"analysis_{timestamp}.json")
@@ -274,6 +306,29 @@ class CameraSurveillance:
         
         logging.info(f"Analysis results saved to {filename}")
     
+    async def process_frame(self, frame, jpg_bytes, image_path):
+        """
+        Analyze a captured frame, save the results and send them to Telegram.
+        
+        Args:
+            frame (ndarray): BGR frame to analyze
+            jpg_bytes (bytes): The frame encoded as JPEG
+            image_path (str): Path the frame is saved to
+        """
+        loop = asyncio.get_running_loop()
+        
+        # Analyze the image in a worker thread so the blocking HTTP call doesn't stall the event loop
+        analysis_result = await loop.run_in_executor(None, self.analyze_image, frame, image_path)
+        
+        # Save analysis results, still sending to Telegram if the write fails
+        try:
+            self.save_analysis_results(analysis_result)
+        except OSError as e:
+            logging.error(f"Error saving analysis results: {str(e)}")
+        
+        # Send to Telegram
+        await self.send_to_telegram(analysis_result, jpg_bytes)
+    
     async def run_surveillance(self, interval=60, duration=None):
         """
         Run continuous surveillance at a specified interval.
@@ -282,9 +337,13 @@ class CameraSurveillance:
             interval (int): Time (in seconds) between captures.
             duration (int or None): Total duration for surveillance (seconds). None for indefinite surveillance.
         """
-        if not self.connect():
+        loop = asyncio.get_running_loop()
+        
+        # Connecting blocks for seconds, so it runs in a worker thread like capture_frame
+        if not await loop.run_in_executor(None, self.connect):
             return
         
+        pending = set()
         start_time = time.time()
         try:
             while True:
@@ -293,43 +352,50 @@ class CameraSurveillance:
                     break
                 
                 # Capture a frame
-                success, image_path = self.capture_frame()
+                success, frame, jpg_bytes, image_path = await loop.run_in_executor(None, self.capture_frame)
                 if not success:
                     logging.error("Failed to capture frame, attempting to reconnect...")
-                    self.disconnect()
-                    if not self.connect():
+                    await loop.run_in_executor(None, self.disconnect)
+                    if not await loop.run_in_executor(None, self.connect):
                         logging.error("Failed to reconnect to camera, exiting...")
                         break
                     continue
                 
-                # Analyze the image
-                analysis_result = self.analyze_image(image_path)
-                
-                # Save analysis results
-                self.save_analysis_results(analysis_result)
+                # Only spend an API call on frames where something changed
+                if not self.has_motion(frame):
+                    await asyncio.sleep(interval)
+                    continue
                 
-                # Send to Telegram
-                await self.send_to_telegram(analysis_result)
+                # Process the frame in the background so a slow analysis doesn't delay the next capture
+                task = asyncio.create_task(self.process_frame(frame, jpg_bytes, image_path))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                task.add_done_callback(log_task_error)
                 
                 # Wait for the next interval
-                time.sleep(interval)
+                await asyncio.sleep(interval)
                 
         except KeyboardInterrupt:
             logging.info("Surveillance stopped by user")
         finally:
-            self.disconnect()
+            # Let in-flight analyses finish before releasing the camera
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            await loop.run_in_executor(None, self.disconnect)
 
 async def main():
     # Camera configuration
     CAMERA_IP = "192.168.1.130"  # Replace with your camera's IP
     USERNAME = "admin"           # Replace with your camera's username
     PASSWORD = "admin"           # Replace with your camera's password
+    USE_GSTREAMER = os.getenv('USE_GSTREAMER', '').lower() in ('1', 'true', 'yes')
     
     # Initialize surveillance system
     surveillance = CameraSurveillance(
         camera_ip=CAMERA_IP,
         username=USERNAME,
-        password=PASSWORD
+        password=PASSWORD,
+        use_gstreamer=USE_GSTREAMER
     )
     
     # Start surveillance (captures and analyzes a frame every 60 seconds)
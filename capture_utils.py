@@ -0,0 +1,164 @@
+import cv2
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Let FFmpeg decode on the GPU (VAAPI, CUDA, D3D11, ...) when one is available,
+# OpenCV falls back to software decoding otherwise
+HW_DECODE_PARAMS = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+
+# Frames skipped before each capture to cut down on queued frames. This only
+# trims a short backlog, it cannot catch up a stream that has buffered far behind
+STALE_FRAMES = 5
+
+# Pause after a failed grab before trying again
+RETRY_DELAY = 0.1
+
+def log_jpeg_backend():
+    """Log which JPEG library OpenCV was built against."""
+    for line in cv2.getBuildInformation().splitlines():
+        name, _, value = line.strip().partition(":")
+        if name == "JPEG":
+            value = value.strip()
+            if "libjpeg-turbo" in value:
+                logging.info(f"OpenCV JPEG codec: {value}")
+            else:
+                logging.warning(f"OpenCV is not using libjpeg-turbo ({value}), JPEG encoding will be slower")
+            return
+    logging.warning("Unable to determine the JPEG codec OpenCV was built with")
+
+def gstreamer_available():
+    """Check whether OpenCV was built with the GStreamer video I/O backend."""
+    for line in cv2.getBuildInformation().splitlines():
+        name, _, value = line.strip().partition(":")
+        if name == "GStreamer":
+            return value.strip().startswith("YES")
+    return False
+
+def open_capture(url, use_gstreamer=False, ffmpeg_options=None):
+    """
+    Open a video capture for an RTSP URL.
+
+    Args:
+        url (str): RTSP URL of the stream.
+        use_gstreamer (bool): Use a GStreamer pipeline instead of the FFmpeg backend.
+        ffmpeg_options (str or None): Value for OPENCV_FFMPEG_CAPTURE_OPTIONS when using FFmpeg.
+
+    Returns:
+        cv2.VideoCapture: The (possibly unopened) capture object.
+    """
+    if use_gstreamer:
+        # Leaky appsink drops stale frames inside the pipeline instead of queueing them
+        pipeline = (
+            f'rtspsrc location="{url}" latency=0 ! rtph264depay ! avdec_h264 ! '
+            "videoconvert ! video/x-raw,format=BGR ! appsink drop=1 max-buffers=1 sync=false"
+        )
+        return cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+
+    # The options variable is process-global and read when the capture opens,
+    # so set it right before opening rather than once per camera
+    if ffmpeg_options is not None:
+        os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = ffmpeg_options
+
+    # Create VideoCapture object with FFmpeg backend
+    return cv2.VideoCapture(url, cv2.CAP_FFMPEG, HW_DECODE_PARAMS)
+
+def probe_url(url, use_gstreamer=False, ffmpeg_options=None):
+    """
+    Open a capture for one RTSP URL and check that it delivers a frame.
+
+    Args:
+        url (str): RTSP URL to try.
+        use_gstreamer (bool): Use a GStreamer pipeline instead of the FFmpeg backend.
+        ffmpeg_options (str or None): Value for OPENCV_FFMPEG_CAPTURE_OPTIONS when using FFmpeg.
+
+    Returns:
+        cv2.VideoCapture or None: The open capture if a test frame was retrieved, None otherwise.
+    """
+    cap = None
+    try:
+        logging.info(f"Attempting to connect using URL: {url}")
+
+        cap = open_capture(url, use_gstreamer, ffmpeg_options)
+        # Keep only the latest frame; honoured by V4L2 and some other backends, FFmpeg ignores it
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        if cap is None or not cap.isOpened():
+            logging.warning(f"Failed to open video capture for URL: {url}")
+            return None
+
+        # Try reading a test frame for a few seconds
+        start_time = time.time()
+        while time.time() - start_time < 5:  # 5 second timeout
+            if cap.grab():
+                ret, frame = cap.retrieve()
+                if ret and frame is not None and frame.size > 0:
+                    logging.info(f"Successfully connected to camera using URL: {url}")
+                    return cap
+            time.sleep(RETRY_DELAY)
+
+        logging.warning(f"Unable to retrieve a test frame from URL: {url}")
+        cap.release()
+
+    except Exception as e:
+        logging.warning(f"Error connecting using URL {url}: {str(e)}")
+        if cap:
+            cap.release()
+    return None
+
+def read_latest_frame(cap, timeout=3):
+    """
+    Skip frames queued since the last read and return the newest one.
+
+    Args:
+        cap (cv2.VideoCapture): Open capture to read from.
+        timeout (float): Seconds to keep retrying failed reads.
+
+    Returns:
+        tuple: (bool, ndarray) - Success status and the BGR frame if successful
+    """
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        # grab() skips the BGR conversion and copy that retrieve() performs
+        for _ in range(STALE_FRAMES):
+            if not cap.grab():
+                break
+        ret, frame = cap.retrieve()
+        if ret and frame is not None and frame.size > 0:
+            return True, frame
+        time.sleep(RETRY_DELAY)
+    return False, None
+
+def release_probe(future):
+    """Release the capture returned by a connection probe that lost the race."""
+    cap = future.result()
+    if cap is not None:
+        cap.release()
+
+def connect_first(urls, use_gstreamer=False, ffmpeg_options=None):
+    """
+    Probe several RTSP URLs in parallel and keep the first that delivers a frame.
+
+    Args:
+        urls (list): RTSP URLs to try.
+        use_gstreamer (bool): Use a GStreamer pipeline instead of the FFmpeg backend.
+        ffmpeg_options (str or None): Value for OPENCV_FFMPEG_CAPTURE_OPTIONS when using FFmpeg.
+
+    Returns:
+        cv2.VideoCapture or None: The open capture, or None if no URL worked.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(urls))
+    futures = [executor.submit(probe_url, url, use_gstreamer, ffmpeg_options) for url in urls]
+    executor.shutdown(wait=False)
+
+    for future in as_completed(futures):
+        cap = future.result()
+        if cap is not None:
+            # Release the captures of any other URLs that also connect
+            for other in futures:
+                if other is not future:
+                    other.add_done_callback(release_probe)
+            return cap
+
+    return None
@@ -4,6 +4,7 @@ import time
 from datetime import datetime
 import logging
 import urllib.parse
+from capture_utils import connect_first, gstreamer_available, log_jpeg_backend, read_latest_frame
 
 # Configure logging
 logging.basicConfig(
@@ -15,8 +16,11 @@ logging.basicConfig(
     ]
 )
 
+# JPEG quality for captured images, down from OpenCV's default of 95
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85]
+
 class CPCameraCapture:
-    def __init__(self, camera_ip, username, password, port=554, channel=1, output_dir="captured_images"):
+    def __init__(self, camera_ip, username, password, port=554, channel=1, use_gstreamer=False, output_dir="captured_images"):
         """
         Initialize the CP Plus camera capture system using multiple RTSP URL formats.
         
@@ -26,6 +30,9 @@ class CPCameraCapture:
             password (str): Camera login password.
             port (int): RTSP port (default: 554).
             channel (int): Camera channel number (default: 1).
+            use_gstreamer (bool): Open the stream through a low-latency GStreamer pipeline
+                instead of FFmpeg (default: False). Falls back to FFmpeg if OpenCV
+                was built without GStreamer.
             output_dir (str): Directory to save captured images.
         """
         self.camera_ip = camera_ip
@@ -36,6 +43,13 @@ class CPCameraCapture:
         self.output_dir = output_dir
         self.cap = None
 
+        if use_gstreamer and not gstreamer_available():
+            logging.warning("OpenCV was built without GStreamer support, falling back to FFmpeg")
+            use_gstreamer = False
+        self.use_gstreamer = use_gstreamer
+
+        log_jpeg_backend()
+
         # Create output directory if it doesn't exist
         os.makedirs(self.output_dir, exist_ok=True)
 
@@ -46,45 +60,22 @@ class CPCameraCapture:
             f"rtsp://{self.username}:{self.password}@{camera_ip}:{port}/Streaming/Channels/{channel}01",
             f"rtsp://{self.username}:{self.password}@{camera_ip}:{port}/live/ch{channel}/main"
         ]
+
+        # FFmpeg options for better streaming and low latency, applied when each capture is opened
+        self.ffmpeg_options = "rtsp_transport;tcp|buffer_size;512000|max_delay;500000|flags;low_delay|fflags;nobuffer"
     
     def connect(self):
         """
         Try connecting to the camera using different RTSP URL formats.
         
+        All URL formats are probed in parallel and the first one to deliver a frame is used.
+        
         Returns:
             bool: True if connection successful and a test frame is retrieved, False otherwise.
         """
-        for url in self.rtsp_urls:
-            try:
-                logging.info(f"Attempting to connect using URL: {url}")
-                
-                # Set FFmpeg options for better streaming
-                os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp|buffer_size;512000|max_delay;500000"
-                
-                # Create VideoCapture object with FFmpeg backend
-                self.cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG)
-                
-                if self.cap is None or not self.cap.isOpened():
-                    logging.warning(f"Failed to open video capture for URL: {url}")
-                    continue
-                    
-                # Try reading a test frame for a few seconds
-                start_time = time.time()
-                while time.time() - start_time < 5:  # 5 second timeout
-                    ret, frame = self.cap.read()
-                    if ret and frame is not None:
-                        logging.info(f"Successfully connected to camera using URL: {url}")
-                        return True
-                    time.sleep(0.1)
-                
-                logging.warning(f"Unable to retrieve a test frame from URL: {url}")
-                self.cap.release()
-                
-            except Exception as e:
-                logging.warning(f"Error connecting using URL {url}: {str(e)}")
-                if self.cap:
-                    self.cap.release()
-                continue
+        self.cap = connect_first(self.rtsp_urls, self.use_gstreamer, self.ffmpeg_options)
+        if self.cap is not None:
+            return True
         
         logging.error("Failed to connect using any available RTSP URL format")
         return False
@@ -100,7 +91,7 @@ class CPCameraCapture:
             logging.error("Camera connection not established")
             return False
         
-        ret, frame = self.cap.read()
+        ret, frame = read_latest_frame(self.cap)
         if not ret:
             logging.error("Failed to capture frame")
             return False
@@ -110,7 +101,7 @@ class CPCameraCapture:
         filename = os.path.join(self.output_dir, f"frame_{timestamp}.jpg")
         
         # Save the frame to a file
-        cv2.imwrite(filename, frame)
+        cv2.imwrite(filename, frame, JPEG_PARAMS)
         logging.info("Captured frame saved to %s", filename)
         return True
     
@@ -149,12 +140,14 @@ def main():
     CAMERA_IP = "192.168.1.229"  # Replace with your camera's IP
     USERNAME = "admin"           # Replace with your camera's username
     PASSWORD = "admin@123"       # Replace with your camera's password
+    USE_GSTREAMER = os.getenv('USE_GSTREAMER', '').lower() in ('1', 'true', 'yes')
     
     # Initialize camera capture with the specified configuration
     camera = CPCameraCapture(
         camera_ip=CAMERA_IP,
         username=USERNAME,
         password=PASSWORD,
+        use_gstreamer=USE_GSTREAMER,
         output_dir="cp_camera_images"
     )
     
@@ -2,32 +2,45 @@ import cv2
 import os
 import google.generativeai as genai
 from datetime import timedelta
-from PIL import Image
-import io
 from dotenv import load_dotenv
 import json
 from datetime import datetime
-import requests
-import base64
-from telegram_notifier import send_summary
+from concurrent.futures import ThreadPoolExecutor
+from capture_utils import HW_DECODE_PARAMS
+from gemini_utils import build_payload_template, encode_image_to_base64, post_image
+from telegram_notifier import run_async, send_summary
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
-GEMINI_FLASH_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent"
+EXAM_PROMPT = """Analyze this exam hall image and identify any suspicious behavior or disciplinary issues.
+Look for:
+1. Students looking at others' papers
+2. Use of unauthorized materials
+3. Communication between students
+4. Use of mobile phones or other electronic devices
+5. Any other suspicious or concerning behavior
 
-def encode_image_to_base64(pil_image):
-    """Convert PIL Image to base64 string."""
-    buffered = io.BytesIO()
-    pil_image.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+Provide a detailed analysis of any suspicious activities found, or confirm if everything appears normal."""
+
+PAYLOAD_TEMPLATE = build_payload_template(EXAM_PROMPT)
+
+# JPEG quality for saved frames and Gemini uploads, up from the Pillow default of 75 used before,
+# so both are somewhat larger in exchange for fewer compression artifacts
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85]
+
+# Maximum number of Gemini requests in flight at once
+GEMINI_CONCURRENCY = 8
+
+# Number of threads writing frame images to disk
+FRAME_SAVE_WORKERS = 4
+
+# Telegram allows roughly one message per second to a single chat
+TELEGRAM_MESSAGE_INTERVAL = 1
 
 def extract_frames(video_path, interval_seconds=60):
     """Extract frames from video at specified interval."""
-    cap = cv2.VideoCapture(video_path)
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, HW_DECODE_PARAMS)
     if not cap.isOpened():
         raise ValueError("Error: Could not open video file")
 
@@ -38,16 +51,19 @@ def extract_frames(video_path, interval_seconds=60):
     frames = []
     frame_count = 0
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    while True:
+        # grab() still decodes every frame, but only sampled frames pay for the
+        # BGR conversion and copy that retrieve() performs
+        if not cap.grab():
             break
             
         if frame_count % frame_interval == 0:
-            # Convert frame from BGR to RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            # Frames stay BGR, which is what OpenCV's JPEG encoder expects
             timestamp = timedelta(seconds=int(frame_count/fps))
-            frames.append((frame_rgb, timestamp))
+            frames.append((frame, timestamp))
             
         frame_count += 1
     
@@ -56,46 +72,11 @@ def extract_frames(video_path, interval_seconds=60):
 
 def analyze_frame(frame, timestamp):
     """Analyze a frame using Gemini Flash 2.0 API."""
-    # Convert numpy array to PIL Image and resize if needed
-    pil_image = Image.fromarray(frame)
-    
-    # Resize image if too large (max 4MB)
-    max_size = (1024, 1024)
-    pil_image.thumbnail(max_size, Image.Resampling.LANCZOS)
-    
     # Convert image to base64
-    image_base64 = encode_image_to_base64(pil_image)
-    
-    # Create the request payload
-    payload = {
-        "contents": [{
-            "parts":[{
-                "text": """Analyze this exam hall image and identify any suspicious behavior or disciplinary issues. 
-                Look for:
-                1. Students looking at others' papers
-                2. Use of unauthorized materials
-                3. Communication between students
-                4. Use of mobile phones or other electronic devices
-                5. Any other suspicious or concerning behavior
-                
-                Provide a detailed analysis of any suspicious activities found, or confirm if everything appears normal."""
-            },
-            {
-                "inline_data": {
-                    "mime_type": "image/jpeg",
-                    "data": image_base64
-                }
-            }]
-        }]
-    }
+    image_base64 = encode_image_to_base64(frame, JPEG_PARAMS)
     
     # Make the API request
-    headers = {
-        'Content-Type': 'application/json',
-        'x-goog-api-key': GEMINI_API_KEY
-    }
-    
-    response = requests.post(GEMINI_FLASH_URL, headers=headers, json=payload)
+    response = post_image(PAYLOAD_TEMPLATE, image_base64)
     
     if response.status_code == 200:
         result = response.json()
@@ -123,17 +104,41 @@ def main():
         frames = extract_frames(video_path)
         print(f"Extracted {len(frames)} frames")
         
-        # Analyze each frame
         results = []
-        for i, (frame, timestamp) in enumerate(frames):
-            print(f"Analyzing frame {i+1}/{len(frames)} at timestamp {timestamp}")
-            analysis = analyze_frame(frame, timestamp)
-            results.append(analysis)
+        frame_saves = []
+        with ThreadPoolExecutor(max_workers=FRAME_SAVE_WORKERS) as save_pool:
+            # Save frames as images in the background while they are being analyzed
+            for frame, timestamp in frames:
+                frame_filename = f"frame_{timestamp}.jpg"
+                frame_path = os.path.join(output_dir, frame_filename)
+                frame_saves.append((frame_path, save_pool.submit(cv2.imwrite, frame_path, frame, JPEG_PARAMS)))
             
-            # Save frame as image
-            frame_filename = f"frame_{timestamp}.jpg"
-            frame_path = os.path.join(output_dir, frame_filename)
-            Image.fromarray(frame).save(frame_path)
+            # Analyze frames concurrently, the API calls spend nearly all their time waiting on the network
+            with ThreadPoolExecutor(max_workers=GEMINI_CONCURRENCY) as pool:
+                futures = [pool.submit(analyze_frame, frame, timestamp) for frame, timestamp in frames]
+                for i, future in enumerate(futures):
+                    timestamp = frames[i][1]
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        # Keep the rest of the batch when a single request fails
+                        print(f"Error analyzing frame at timestamp {timestamp}: {str(e)}")
+                        results.append({
+                            'timestamp': str(timestamp),
+                            'analysis': f"Error: {str(e)}"
+                        })
+                    print(f"Analyzed frame {i+1}/{len(frames)} at timestamp {timestamp}")
+        
+        # cv2.imwrite reports most failures by returning False rather than raising
+        failed_saves = 0
+        for frame_path, future in frame_saves:
+            try:
+                if future.result():
+                    continue
+                print(f"Failed to save frame to {frame_path}")
+            except Exception as e:
+                print(f"Error saving frame to {frame_path}: {str(e)}")
+            failed_saves += 1
         
         # Save results to JSON file
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -142,7 +147,10 @@ def main():
             json.dump(results, f, indent=4)
             
         print(f"\nAnalysis complete! Results saved to {results_file}")
-        print(f"Frames saved in {output_dir}")
+        if failed_saves:
+            print(f"Frames saved in {output_dir} ({failed_saves} of {len(frames)} could not be saved)")
+        else:
+            print(f"Frames saved in {output_dir}")
         
         # Send analysis summary to Telegram
         print("Sending analysis summary to Telegram...")
@@ -165,10 +173,13 @@ def main():
                     f"<b>Timestamp:</b> {timestamp}\n"
                     f"<b>Analysis:</b> {analysis}"
                 )
-                await notifier.send_message(message)
-                await asyncio.sleep(1)  # Small delay between messages to avoid rate limits
+                # Overlap the send with the rate limit delay, keeping messages in order
+                await asyncio.gather(
+                    notifier.send_message(message),
+                    asyncio.sleep(TELEGRAM_MESSAGE_INTERVAL)
+                )
 
-        asyncio.run(send_results_one_by_one(results_file))
+        run_async(send_results_one_by_one(results_file))
         # send_summary(results_file)
         print("Summary sent to Telegram!")
         
@@ -0,0 +1,81 @@
+import cv2
+import os
+import base64
+import orjson
+import requests
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Configure Gemini API
+GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
+GEMINI_FLASH_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp:generateContent"
+GEMINI_TIMEOUT = 30
+
+# Reuse one keep-alive connection for all Gemini requests instead of a new TCP+TLS handshake per frame
+GEMINI_SESSION = requests.Session()
+GEMINI_SESSION.headers.update({
+    'Content-Type': 'application/json',
+    'x-goog-api-key': GEMINI_API_KEY
+})
+
+# Largest width or height of images uploaded for analysis
+MAX_IMAGE_SIZE = 1024
+
+def build_payload_template(prompt):
+    """
+    Serialize the parts of a Gemini request body that surround the image data.
+
+    The request body only varies in the image, so everything around it is serialized once.
+
+    Args:
+        prompt (str): Text prompt sent with every image.
+
+    Returns:
+        tuple: (bytes, bytes) - Body prefix and suffix to place around the base64 image
+    """
+    prefix = (
+        b'{"contents":[{"parts":[{"text":' + orjson.dumps(prompt) +
+        b'},{"inline_data":{"mime_type":"image/jpeg","data":"'
+    )
+    suffix = b'"}}]}]}'
+    return prefix, suffix
+
+def encode_image_to_base64(frame, jpeg_params):
+    """
+    Downscale a BGR frame for upload and convert it to base64-encoded JPEG bytes.
+
+    Args:
+        frame (ndarray): BGR frame to encode.
+        jpeg_params (list): cv2.imencode parameters.
+
+    Returns:
+        bytes: Base64-encoded JPEG image
+    """
+    # Resize image if too large (max 4MB)
+    height, width = frame.shape[:2]
+    scale = min(MAX_IMAGE_SIZE / width, MAX_IMAGE_SIZE / height, 1.0)
+    if scale < 1.0:
+        frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    # OpenCV's bundled libjpeg-turbo encodes straight from BGR
+    ok, buffer = cv2.imencode('.jpg', frame, jpeg_params)
+    if not ok:
+        raise ValueError("Failed to encode frame as JPEG")
+    return base64.b64encode(buffer)
+
+def post_image(payload_template, image_base64):
+    """
+    Send one image to Gemini for analysis.
+
+    Args:
+        payload_template (tuple): Body prefix and suffix from build_payload_template.
+        image_base64 (bytes): Base64-encoded JPEG image.
+
+    Returns:
+        requests.Response: The raw API response
+    """
+    prefix, suffix = payload_template
+    # Splice the image into the pre-serialized payload instead of serializing the whole body
+    return GEMINI_SESSION.post(GEMINI_FLASH_URL, data=prefix + image_base64 + suffix, timeout=GEMINI_TIMEOUT)
@@ -1,8 +1,10 @@
 import os
+import re
 import json
 from datetime import datetime
 import asyncio
 from telegram import Bot
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 import logging
 
@@ -12,6 +14,18 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Connection pool shared by every notifier, so sends reuse keep-alive HTTP/2 connections
+TELEGRAM_REQUEST = HTTPXRequest(connection_pool_size=16, http_version='2')
+
+# Event loop for the synchronous helpers, created on first use. The shared pool's connections
+# are tied to the loop they were opened on, so it is kept alive between calls instead of
+# using asyncio.run
+_event_loop = None
+
+# Keywords that flag an analysis entry as suspicious, matched in one pass over the text
+SUSPICIOUS_KEYWORDS = ['suspicious', 'looking', 'phone', 'talking', 'communication', 'device', 'cheating']
+SUSPICIOUS_PATTERN = re.compile('|'.join(map(re.escape, SUSPICIOUS_KEYWORDS)), re.IGNORECASE)
+
 class TelegramNotifier:
     def __init__(self):
         """Initialize the Telegram notifier."""
@@ -22,7 +36,7 @@ class TelegramNotifier:
         if not self.bot_token or not self.chat_id:
             raise ValueError("TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID must be set in .env file")
         
-        self.bot = Bot(token=self.bot_token)
+        self.bot = Bot(token=self.bot_token, request=TELEGRAM_REQUEST)
     
     async def send_message(self, message):
         """Send a message to the configured Telegram chat."""
@@ -53,11 +67,9 @@ class TelegramNotifier:
             suspicious_activities = []
             for entry in results:
                 timestamp = entry['timestamp']
-                analysis = entry['analysis'].lower()
                 
                 # Check for suspicious keywords
-                keywords = ['suspicious', 'looking', 'phone', 'talking', 'communication', 'device', 'cheating']
-                if any(keyword in analysis for keyword in keywords):
+                if SUSPICIOUS_PATTERN.search(entry['analysis']):
                     suspicious_activities.append(f"⚠️ At {timestamp}:\n{entry['analysis']}\n")
             
             if suspicious_activities:
@@ -77,12 +89,27 @@ class TelegramNotifier:
             logging.error(error_msg)
             await self.send_message(f"❌ {error_msg}")
 
+def run_async(coro):
+    """
+    Run a coroutine to completion on the notifier's persistent event loop.
+    
+    Args:
+        coro (coroutine): The coroutine to run
+    """
+    global _event_loop
+    if _event_loop is None:
+        _event_loop = asyncio.new_event_loop()
+    return _event_loop.run_until_complete(coro)
+
 def send_summary(json_file_path):
     """
     Helper function to send analysis summary without dealing with async directly.
     
+    Must be called from synchronous code; from inside a running event loop, await
+    TelegramNotifier().send_analysis_summary(json_file_path) instead.
+    
     Args:
         json_file_path (str): Path to the JSON file containing analysis results
     """
     notifier = TelegramNotifier()
-    asyncio.run(notifier.send_analysis_summary(json_file_path))
\ No newline at end of file
+    run_async(notifier.send_analysis_summary(json_file_path))
\ No newline at end of file